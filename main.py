@@ -1,14 +1,22 @@
 import os
 import re
-import uuid
+import base64
+import functools
+import hashlib
+import mimetypes
+import itertools
 import asyncio
 import sys
+import time
+import weakref
+from pathlib import Path
 from typing import List
 
 # 确保安装了 mistune 和 playwright
 # pip install mistune playwright
 import mistune
-from playwright.async_api import async_playwright, Browser, Playwright
+from playwright.async_api import async_playwright, Browser, BrowserContext, CDPSession, Page, Playwright, Route
+from playwright.async_api import Error as PlaywrightError
 
 from astrbot.api import logger
 from astrbot.api.event import filter, AstrMessageEvent
@@ -17,6 +25,184 @@ from astrbot.core.message.components import Image, Plain
 from astrbot.core.provider.entities import LLMResponse, ProviderRequest
 from astrbot.core.star.star_tools import StarTools
 
+# 正则在模块加载时统一编译，热路径上直接调用，避免 re 模块缓存查找与淘汰
+# <md> 内部的 LaTeX 清洗：还原转义符，与依次 replace \$ -> $、\\$ -> $、\\_ -> _ 的结果一致
+# ($ 前连续 1~2 个反斜杠去掉 1 个，3 个及以上去掉 3 个；_ 前去掉 2 个)
+_RE_LATEX_UNESCAPE = re.compile(r'(?:\\{3}|\\)(\$)|\\\\(_)')
+# <md> 内部的行内公式空格修复，须依次执行：先 $ \sin -> $\sin，再 $ x $ -> $x$
+_RE_DOLLAR_BACKSLASH = re.compile(r'\$\s+(\\)')
+_RE_DOLLAR_WRAP = re.compile(r'\$\s+(.*?)\s+\$')
+
+# remove_markdown 的预检：不含任何 Markdown 标记字符的文本直接原样返回
+_MD_FAST = re.compile(r"[`*_#>\[\]\-]")
+
+# remove_markdown 使用的各类 Markdown 语法，按顺序逐条替换：
+# 先去掉粗体再匹配斜体，***粗斜体*** 这类嵌套标记才能剥离干净，不能合并为单次扫描
+_RE_MARKDOWN_PASSES = (
+    (re.compile(r"```(?:[a-zA-Z0-9+\-]*\s+)?([\s\S]*?)```"), r"\1"),                        # 代码块 (保留内容)
+    (re.compile(r"`([^`]+)`"), r"\1"),                                                      # 行内代码
+    (re.compile(r"\*\*([^*]+)\*\*"), r"\1"),                                                # 粗体 **text**
+    (re.compile(r"__([^_]+)__"), r"\1"),                                                    # 粗体 __text__
+    (re.compile(r"(^|[^\w\*])\*(?!\s)([^*]+)(?<!\s)\*(?=$|[^\w\*])"), r"\1\2"),              # 斜体 *text*
+    (re.compile(r"(^|[^\w_])_(?!\s)([^_]+)(?<!\s)_(?=$|[^\w_])"), r"\1\2"),                  # 斜体 _text_
+    (re.compile(r"^(#{1,6})\s+(.*)", re.MULTILINE), r"\2"),                                 # 标题 #
+    (re.compile(r"^>\s+(.*)", re.MULTILINE), r"\1"),                                        # 引用 >
+    (re.compile(r"\[([^\]]+)\]\([^)]+\)"), r"\1"),                                          # 链接 [text](url) -> text
+    (re.compile(r"^\s*[-*]\s+(.*)", re.MULTILINE), r"\1"),                                 # 列表标记 - 或 *
+)
+
+# Markdown 解析器 (启用数学公式、表格等插件)，模块级单例，插件重载时无需重建
+_MD_RENDER = mistune.create_markdown(
+    plugins=['table', 'math', 'strikethrough', 'task_lists', 'url']
+)
+
+# MathJax 固定版本：本地镜像按版本存放，避免混用不同版本的分包文件
+_MATHJAX_VERSION = "3.2.2"
+_MATHJAX_CDN = f"https://cdn.jsdelivr.net/npm/mathjax@{_MATHJAX_VERSION}/"
+# 渲染页加载的 MathJax 主脚本 (相对 CDN 根路径)；SVG 输出配合 fontCache: 'global'，
+# 公式字形直接内联为路径，无需再加载 Web 字体
+_MATHJAX_ENTRY = "es5/tex-mml-svg.js"
+
+# 渲染页模板版本：修改模板 (CSS、布局、MathJax 加载方式) 时递增，使旧的缓存图片失效
+_HTML_TEMPLATE_VERSION = 3
+# 缓存键的前缀盐：渲染结果同时取决于模板与 MathJax 版本，任一变化都换用新的键
+_CACHE_KEY_SALT = f"{_HTML_TEMPLATE_VERSION}|{_MATHJAX_VERSION}\n".encode("utf-8")
+
+# 渲染页不加载的外部资源类型 (MathJax 资源走本地镜像路由，不受此限制)
+_BLOCKED_RESOURCE_TYPES = frozenset({"image", "font", "media"})
+
+# 渲染页的 MathJax 配置与主脚本；内容不含公式时整段省略，不加载也不解析 MathJax
+_MATHJAX_SCRIPTS = """\
+    <script>
+    window.MathJax = {
+        tex: {
+            inlineMath: [['$', '$'], ['\\\\(', '\\\\)']],
+            displayMath: [['$$', '$$'], ['\\\\[', '\\\\]']],
+        },
+        options: { enableMenu: false },
+        svg: { fontCache: 'global' },
+        startup: { typeset: false } 
+    };
+    </script>
+    <script id="MathJax-script" src="%s"></script>
+""" % (_MATHJAX_CDN + _MATHJAX_ENTRY)
+
+# 公式分隔符 (含 MathJax 默认识别的 \begin{...} 环境)，均未出现时渲染页不加载 MathJax
+_MATH_MARKERS = ("$", "\\(", "\\[", "\\begin")
+
+# 渲染页 HTML 头部模板 (MathJax 脚本、GitHub 风格 CSS、自适应布局)，直到 <body> 为止；
+# 只随 min_width 与是否含公式变化，经 _html_head() 格式化一次后缓存，正文直接拼接
+_HTML_HEAD_TEMPLATE = """\
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+{mathjax}\
+    <style>
+        /* 彻底隐藏 MathJax Loading 条 */
+        #MathJax_Message {{
+            display: none !important;
+            visibility: hidden !important;
+            opacity: 0 !important;
+        }}
+
+        body {{
+            /* 自适应宽度布局 */
+            width: fit-content;
+            min-width: {min_width}px;
+            max-width: 1500px;
+
+            padding: 20px;
+            margin: 0;
+            background-color: white;
+            display: inline-block; /* 配合 fit-content */
+
+            font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Helvetica, Arial, sans-serif;
+            font-size: 16px;
+            line-height: 1.6;
+            color: #24292e;
+        }}
+
+        img {{ max-width: 100%; height: auto; }}
+
+        pre {{
+            background-color: #f6f8fa;
+            border-radius: 6px;
+            padding: 16px;
+            overflow: auto;
+            font-family: SFMono-Regular, Consolas, "Liberation Mono", Menlo, monospace;
+            font-size: 85%;
+            line-height: 1.45;
+        }}
+
+        table {{ border-collapse: collapse; margin-bottom: 16px; min-width: 50%; }}
+        th, td {{ border: 1px solid #dfe2e5; padding: 6px 13px; }}
+        tr:nth-child(2n) {{ background-color: #f6f8fa; }}
+        th {{ font-weight: 600; background-color: #f6f8fa; }}
+
+        blockquote {{
+            margin: 0;
+            padding: 0 1em;
+            color: #6a737d;
+            border-left: 0.25em solid #dfe2e5;
+        }}
+
+        h1, h2, h3 {{ border-bottom: 1px solid #eaecef; padding-bottom: .3em; }}
+    </style>
+</head>
+<body>
+    """
+_HTML_TAIL = """
+</body>
+</html>
+"""
+
+# data: URL 载入渲染页的长度上限：Chromium 拒绝超过 2MB 的 URL，留出余量
+_DATA_URL_MAX_LEN = 2 * 1024 * 1024 - 64 * 1024
+
+# 临时文件序号：进程号 + 自增计数即可保证唯一，无需每次生成随机 UUID
+_TMP_SEQ = itertools.count()
+
+def _write_file_atomic(path: str, data: bytes):
+    """先写临时文件再替换，避免并发读取方看到写了一半的文件"""
+    tmp_path = f"{path}.{os.getpid()}_{next(_TMP_SEQ)}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def _split_md_tags(text: str):
+    """
+    按 <md>...</md> 拆分文本，依次产出 (是否为标签块, 片段)：标签外文本或标签内的内容 (不含标签)。
+    用 str.find 顺序扫描代替正则拆分；未闭合的 <md> 按普通文本处理。
+    """
+    i = 0
+    while True:
+        j = text.find("<md>", i)
+        if j < 0:
+            yield False, text[i:]
+            return
+        k = text.find("</md>", j + 4)
+        if k < 0:
+            yield False, text[i:]
+            return
+        yield False, text[i:j]
+        yield True, text[j + 4:k]
+        i = k + 5
+
+@functools.lru_cache(maxsize=512)
+def _markdown_to_html(md_text: str) -> str:
+    """Markdown -> HTML；LLM 常重复输出相同的公式/表格，按内容缓存转换结果"""
+    return _MD_RENDER(md_text)
+
+@functools.lru_cache(maxsize=8)
+def _html_head(min_width: int, with_math: bool) -> str:
+    """渲染页 <body> 之前的部分；参数取值很少，格式化结果按参数缓存"""
+    return _HTML_HEAD_TEMPLATE.format(min_width=min_width, mathjax=_MATHJAX_SCRIPTS if with_math else "")
+
+def _has_math(md_text: str) -> bool:
+    """粗略判断内容是否可能含公式；宁可误判为有，也不能漏掉"""
+    return any(marker in md_text for marker in _MATH_MARKERS)
+
 @register(
     "astrbot_plugin_md2img",
     "tosaki",
@@ -24,51 +210,164 @@ from astrbot.core.star.star_tools import StarTools
     "1.6.0",
 )
 class MarkdownConverterPlugin(Star):
+    # 页面池上限：同时存活的渲染页面数，也即同时进行的渲染数；按 CPU 核数封顶，避免并发渲染撑爆内存
+    PAGE_POOL_SIZE = min(os.cpu_count() or 1, 4)
+    # 初始化时预热的页面数
+    PAGE_POOL_PREWARM = 2
+    # 单个页面渲染多少次后关闭重建，限制渲染进程内存增长
+    PAGE_RECYCLE_EVERY = 100
+    # 共享上下文累计渲染多少次后整体重建，回收页面关闭后仍滞留的渲染进程内存
+    CONTEXT_RECYCLE_EVERY = 200
+    # 渲染结果缓存上限：按最近使用时间保留的图片数
+    IMAGE_CACHE_MAX_FILES = 500
+    # 超过该天数未被使用的缓存图片会被清理
+    IMAGE_CACHE_MAX_AGE_DAYS = 7
+    # 后台清理缓存目录的间隔 (秒)
+    IMAGE_CACHE_GC_INTERVAL = 3600
+
     def __init__(self, context: Context):
         super().__init__(context)
         self.DATA_DIR = os.path.normpath(StarTools.get_data_dir())
         self.IMAGE_CACHE_DIR = os.path.join(self.DATA_DIR, "md2img_cache")
+        # 缓存图片路径前缀，渲染时直接拼接文件名，省去每次 os.path.join
+        self._cache_prefix = self.IMAGE_CACHE_DIR + os.sep
+        self.MATHJAX_DIR = os.path.join(self.DATA_DIR, "mathjax", _MATHJAX_VERSION)
+        # 已读入内存的 MathJax 资源 (相对路径 -> 内容)，渲染时直接从内存响应
+        self._mathjax_assets: dict = {}
         
         # Playwright 实例持久化，避免重复启动
         self.playwright: Playwright = None
         self.browser: Browser = None
+        self._browser_lock = asyncio.Lock()
+
+        # 按内容哈希加锁，相同内容的并发请求只渲染一次；无人持有时自动回收
+        self._render_locks: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+        self._cache_gc_task: asyncio.Task = None
         
-        # 初始化 Markdown 解析器 (启用数学公式、表格等插件)
-        self.markdown_parser = mistune.create_markdown(
-            plugins=['table', 'math', 'strikethrough', 'task_lists', 'url']
-        )
+        # 共享的浏览器上下文与预热页面池，避免每次渲染都新建 context/page
+        self.context: BrowserContext = None
+        self._page_pool: List[Page] = []
+        self._page_slots: asyncio.Semaphore = None
+        self._page_uses: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        # 每个页面复用同一个 CDP 会话截图，页面关闭回收后自动释放
+        self._cdp_sessions: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._context_renders = 0
 
     async def initialize(self):
-        """初始化插件：检查依赖、创建目录并启动浏览器"""
+        """初始化插件：创建目录、清理缓存并启动浏览器"""
         try:
             os.makedirs(self.IMAGE_CACHE_DIR, exist_ok=True)
+            if not self._cache_gc_task:
+                self._cache_gc_task = asyncio.create_task(self._gc_cache())
             
-            # 1. 检查并自动安装 Playwright 浏览器依赖 (完整逻辑)
-            await self._ensure_playwright_installed()
-
-            # 2. 预启动浏览器 (关键优化)
+            # 预启动浏览器 (关键优化)
             logger.info("Markdown插件: 正在启动 Playwright Browser...")
-            self.playwright = await async_playwright().start()
-            
-            # 启动配置：无头模式，禁用沙箱以适应 Docker/Linux 环境
-            self.browser = await self.playwright.chromium.launch(
-                headless=True,
-                args=['--no-sandbox', '--disable-setuid-sandbox']
-            )
+            await self._start_browser(install=True)
+            await self._prefetch_mathjax()
             logger.info("Markdown插件: 初始化完成，浏览器已就绪。")
 
         except Exception as e:
             logger.error(f"Markdown插件初始化失败: {e}")
             logger.error("如果是因为缺少浏览器，请尝试手动运行: playwright install chromium")
 
+    async def _start_browser(self, install: bool = False):
+        """启动 (或重连) 浏览器，并重建共享上下文与页面池；install 仅由 initialize 传入，重连时不安装"""
+        if not self.playwright:
+            self.playwright = await async_playwright().start()
+        # 初始化时先探测 Chromium 可执行文件：缺失时直接安装，省去一次必然失败的启动
+        installed = False
+        if install and not os.access(self.playwright.chromium.executable_path, os.X_OK):
+            logger.warning("Markdown插件: 未找到 Chromium，尝试自动安装...")
+            await self._ensure_playwright_installed()
+            installed = True
+        try:
+            self.browser = await self._launch_browser()
+        except PlaywrightError as e:
+            # 驱动进程本身可能已退出 (如被 OOM 杀掉)，旧连接无法再启动浏览器：换用新驱动重试一次
+            logger.warning(f"Markdown插件: Chromium 启动失败，重启 Playwright 驱动后重试: {e}")
+            await self._restart_playwright()
+            try:
+                self.browser = await self._launch_browser()
+            except PlaywrightError as e:
+                if not install or installed:
+                    raise
+                # 仅在初始化时启动仍失败 (浏览器或系统依赖缺失) 才安装，重连路径不拉起安装子进程
+                logger.warning(f"Markdown插件: Chromium 启动失败，尝试自动安装: {e}")
+                await self._ensure_playwright_installed()
+                self.browser = await self._launch_browser()
+        # 槽位跨重连/重建共用：进行中的渲染无论成败都会在归还页面时释放槽位
+        if not self._page_slots:
+            self._page_slots = asyncio.Semaphore(self.PAGE_POOL_SIZE)
+        await self._new_context()
+
+    async def _restart_playwright(self):
+        """停止旧的 Playwright 驱动 (可能已随进程退出而失效) 并启动新的驱动"""
+        try:
+            await self.playwright.stop()
+        except Exception as e:
+            logger.warning(f"Markdown插件: 停止旧的 Playwright 驱动失败: {e}")
+        self.playwright = await async_playwright().start()
+
+    async def _new_context(self):
+        """新建共享上下文 (注册资源路由) 并预热页面池"""
+        # 使用大 Viewport 防止宽公式强制换行
+        self.context = await self.browser.new_context(
+            device_scale_factor=2, 
+            viewport={'width': 1600, 'height': 1200} 
+        )
+        # 路由按注册的逆序匹配：MathJax 资源走本地镜像，其余外部图片/字体/媒体直接拒绝
+        await self.context.route("**/*", self._block_external_resource)
+        await self.context.route(f"{_MATHJAX_CDN}**", self._serve_mathjax_asset)
+        self._page_pool = [await self.context.new_page() for _ in range(min(self.PAGE_POOL_PREWARM, self.PAGE_POOL_SIZE))]
+        self._context_renders = 0
+
+    async def _recycle_context(self):
+        """换用新的共享上下文；旧上下文的空闲页面立即关闭，仍在渲染的页面归还后随上下文一并关闭"""
+        old_context, idle_pages = self.context, self._page_pool
+        await self._new_context()
+        for page in idle_pages:
+            if not page.is_closed():
+                await page.close()
+        if all(p.is_closed() for p in old_context.pages):
+            await old_context.close()
+        logger.info("Markdown插件: 浏览器上下文已重建")
+
     async def terminate(self):
         """插件卸载或重载时清理资源"""
+        if self._cache_gc_task:
+            self._cache_gc_task.cancel()
+        if self.context:
+            await self.context.close()
         if self.browser:
             await self.browser.close()
         if self.playwright:
             await self.playwright.stop()
         logger.info("Markdown插件: 已停止")
 
+    async def _launch_browser(self) -> Browser:
+        """启动 Chromium：无头模式，禁用沙箱以适应 Docker/Linux 环境"""
+        return await self.playwright.chromium.launch(
+            headless=True,
+            chromium_sandbox=False,
+            # 浏览器生命周期由插件的 terminate() 管理，不随宿主进程的信号自行退出
+            handle_sigint=False,
+            handle_sigterm=False,
+            args=[
+                '--no-sandbox',
+                '--disable-setuid-sandbox',
+                # 容器内 /dev/shm 往往很小，改用 /tmp 避免渲染进程崩溃
+                '--disable-dev-shm-usage',
+                # 渲染静态页面用不到 GPU、扩展、音频和后台联网
+                '--disable-gpu',
+                '--disable-accelerated-2d-canvas',
+                '--disable-extensions',
+                '--disable-background-networking',
+                '--disable-background-timer-throttling',
+                '--mute-audio',
+                # 不加 --single-process：MathJax 这类重 JS 负载下容易崩溃
+            ]
+        )
+
     async def _ensure_playwright_installed(self):
         """
         自动检测并安装 Playwright 的 Chromium 浏览器和系统依赖。
@@ -82,7 +381,7 @@ class MarkdownConverterPlugin(Star):
             )
             stdout, stderr = await process.communicate()
             
-            output = stdout.decode('utf-8', errors='ignore')
+            output = stdout.decode('utf-8', errors='ignore') if stdout else ""
             if process.returncode != 0:
                 err_msg = stderr.decode('utf-8', errors='ignore')
                 logger.error(f"{desc} 安装失败: {err_msg}")
@@ -95,19 +394,13 @@ class MarkdownConverterPlugin(Star):
             return True
 
         try:
-            # 1. 安装 Chromium 浏览器
-            await run_cmd(
-                [sys.executable, "-m", "playwright", "install", "chromium"], 
-                "Playwright Chromium Browser"
-            )
-            
-            # 2. (可选) Linux 环境安装系统依赖
+            install_cmd = [sys.executable, "-m", "playwright", "install"]
+            # Linux 环境用一条 --with-deps 命令同时安装浏览器与系统依赖，只拉起一个子进程；
+            # 没有 sudo 权限时依赖安装会失败，此时退回只安装浏览器
             if sys.platform.startswith("linux"):
-                # 不阻塞报错，因为可能没有 sudo 权限
-                await run_cmd(
-                    [sys.executable, "-m", "playwright", "install-deps"], 
-                    "System Dependencies (Linux)"
-                )
+                if await run_cmd(install_cmd + ["--with-deps", "chromium"], "Playwright Chromium Browser + System Dependencies"):
+                    return
+            await run_cmd(install_cmd + ["chromium"], "Playwright Chromium Browser")
 
         except Exception as e:
             logger.warning(f"自动安装 Playwright 依赖时发生异常 (可忽略): {e}")
@@ -133,65 +426,130 @@ class MarkdownConverterPlugin(Star):
         
         for item in result.chain:
             if isinstance(item, Plain):
-                # 调用核心处理逻辑
-                components = await self._process_text_with_markdown(item.text)
-                new_chain.extend(components)
+                if "<md>" in item.text:
+                    # 调用核心处理逻辑
+                    components = await self._process_text_with_markdown(item.text)
+                    new_chain.extend(components)
+                elif not _MD_FAST.search(item.text):
+                    # 最快路径：既无 <md> 标签也无 Markdown 标记，原样保留
+                    new_chain.append(item)
+                else:
+                    # 快速路径：没有 <md> 标签时跳过拆分与渲染，只做纯文本净化
+                    cleaned_text = self.remove_markdown(item.text.strip())
+                    if cleaned_text.strip():
+                        new_chain.append(Plain(cleaned_text))
             else:
                 new_chain.append(item)
                 
         result.chain = new_chain
 
     async def _process_text_with_markdown(self, text: str) -> List:
-        """解析文本：标签内渲染图片，标签外移除 Markdown"""
-        components = []
-        # 正则：非贪婪匹配 <md>...</md>
-        pattern = r"(<md>.*?</md>)"
-        parts = re.split(pattern, text, flags=re.S)
-
-        for part in parts:
+        """解析文本：标签内渲染图片 (多个 <md> 块并发渲染)，标签外移除 Markdown"""
+        # 按原始顺序保存组件；<md> 块先占位为 (渲染任务, 源文本)，全部完成后再回填
+        slots = []
+        for is_md, part in _split_md_tags(text):
             part = part.strip()
             if not part:
                 continue
 
-            if part.startswith("<md>") and part.endswith("</md>"):
+            if is_md:
                 # ============ 1. 处理 <md> 内部 (渲染图片) ============
-                md_content = part[4:-5].strip()
-                if not md_content:
-                    continue
+                md_content = part
 
                 # --- LaTeX 语法清洗与修复 ---
-                # 还原转义符 \$ -> $
-                md_content = md_content.replace(r"\$", "$")
-                md_content = md_content.replace(r"\\$", "$")
-                md_content = md_content.replace(r"\\_", "_")
-                
-                # 修复行内公式空格: $ \sin -> $\sin (Mistune 兼容性)
-                md_content = re.sub(r'\$\s+(\\)', r'$\1', md_content)
-                md_content = re.sub(r'\$\s+(.*?)\s+\$', r'$\1$', md_content)
+                # 一次扫描还原转义符，再依次修复行内公式空格 (Mistune 兼容性)
+                md_content = _RE_LATEX_UNESCAPE.sub(r'\1\2', md_content)
+                md_content = _RE_DOLLAR_BACKSLASH.sub(r'$\1', md_content)
+                md_content = _RE_DOLLAR_WRAP.sub(r'$\1$', md_content)
                 # --------------------------
 
-                image_filename = f"{uuid.uuid4()}.png"
-                output_path = os.path.join(self.IMAGE_CACHE_DIR, image_filename)
-
-                try:
-                    await self._render_image(md_content, output_path)
-                    if os.path.exists(output_path):
-                        components.append(Image.fromFileSystem(output_path))
-                    else:
-                        components.append(Plain(f"--- 渲染失败 (文件未生成) ---\n{md_content}"))
-                except Exception as e:
-                    logger.error(f"Markdown 渲染异常: {e}")
-                    components.append(Plain(f"--- 渲染异常 ---\n{md_content}"))
+                slots.append((asyncio.create_task(self._render_md(md_content)), md_content))
             
             else:
                 # ============ 2. 处理 <md> 外部 (Markdown Killer) ============
                 # 只有标签外部的内容才需要移除 Markdown 格式
                 cleaned_text = self.remove_markdown(part)
                 if cleaned_text.strip():
-                    components.append(Plain(cleaned_text))
+                    slots.append(Plain(cleaned_text))
 
+        tasks = [slot[0] for slot in slots if isinstance(slot, tuple)]
+        if tasks:
+            # 单个块出错不影响其余块，也不丢失整条回复
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        components = []
+        for slot in slots:
+            if not isinstance(slot, tuple):
+                components.append(slot)
+                continue
+            task, md_content = slot
+            if task.exception() is not None:
+                logger.error(f"Markdown 渲染异常: {task.exception()}")
+                components.append(Plain(f"--- 渲染异常 ---\n{md_content}"))
+            else:
+                components.append(task.result())
         return components
 
+    async def _render_md(self, md_content: str):
+        """渲染单个 <md> 块，失败时退回为纯文本组件"""
+        # 以内容哈希 (含渲染版本) 命名，相同内容直接复用已渲染的图片
+        key = hashlib.blake2b(_CACHE_KEY_SALT + md_content.encode("utf-8"), digest_size=16).hexdigest()
+        output_path = self._cache_prefix + key + ".png"
+        cached = self._cached_image(output_path)
+        if cached is not None:
+            return cached
+
+        lock = self._render_locks.get(key)
+        if lock is None:
+            lock = self._render_locks[key] = asyncio.Lock()
+        async with lock:
+            # 等锁期间可能已由同内容的请求渲染完成
+            cached = self._cached_image(output_path)
+            if cached is not None:
+                return cached
+            try:
+                png = await self._render_image(md_content)
+                await asyncio.to_thread(_write_file_atomic, output_path, png)
+            except Exception as e:
+                logger.error(f"Markdown 渲染异常: {e}")
+                return Plain(f"--- 渲染异常 ---\n{md_content}")
+        return Image.fromFileSystem(output_path)
+
+    def _cached_image(self, output_path: str):
+        """命中缓存时刷新修改时间 (供缓存清理按最近使用排序) 并返回图片组件"""
+        try:
+            os.utime(output_path)
+        except FileNotFoundError:
+            return None
+        return Image.fromFileSystem(output_path)
+
+    async def _gc_cache(self):
+        """后台定期清理图片缓存，插件卸载时随 terminate 取消"""
+        while True:
+            await asyncio.to_thread(self._prune_image_cache)
+            await asyncio.sleep(self.IMAGE_CACHE_GC_INTERVAL)
+
+    def _prune_image_cache(self):
+        """清理超过 IMAGE_CACHE_MAX_AGE_DAYS 未使用的图片，并只保留最近使用的 IMAGE_CACHE_MAX_FILES 张"""
+        try:
+            entries = [
+                (entry.path, entry.stat().st_mtime) for entry in os.scandir(self.IMAGE_CACHE_DIR)
+                if entry.is_file() and entry.name.endswith((".png", ".tmp"))
+            ]
+        except OSError as e:
+            logger.warning(f"Markdown插件: 读取图片缓存目录失败: {e}")
+            return
+
+        entries.sort(key=lambda entry: entry[1], reverse=True)
+        expire_before = time.time() - self.IMAGE_CACHE_MAX_AGE_DAYS * 86400
+        for index, (path, mtime) in enumerate(entries):
+            if index < self.IMAGE_CACHE_MAX_FILES and mtime >= expire_before:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
     def remove_markdown(self, text: str) -> str:
         """
         移除文本中的 Markdown 格式 (保留纯文本内容)
@@ -199,145 +557,188 @@ class MarkdownConverterPlugin(Star):
         """
         if not text:
             return ""
+        if not _MD_FAST.search(text):
+            return text
 
-        # 1. 移除代码块 (保留内容)
-        text = re.sub(r"```(?:[a-zA-Z0-9+\-]*\s+)?([\s\S]*?)```", r"\1", text)
-        # 2. 移除行内代码
-        text = re.sub(r"`([^`]+)`", r"\1", text)
-        # 3. 移除粗体/斜体 (**text**, __text__, *text*, _text_)
-        text = re.sub(r"\*\*([^*]+)\*\*", r"\1", text)
-        text = re.sub(r"__([^_]+)__", r"\1", text)
-        text = re.sub(r"(^|[^\w\*])\*(?!\s)([^*]+)(?<!\s)\*(?=$|[^\w\*])", r"\1\2", text)
-        text = re.sub(r"(^|[^\w_])_(?!\s)([^_]+)(?<!\s)_(?=$|[^\w_])", r"\1\2", text)
-        # 4. 移除标题 #
-        text = re.sub(r"^(#{1,6})\s+(.*)", r"\2", text, flags=re.MULTILINE)
-        # 5. 移除引用 >
-        text = re.sub(r"^>\s+(.*)", r"\1", text, flags=re.MULTILINE)
-        # 6. 移除链接 [text](url) -> text
-        text = re.sub(r"\[([^\]]+)\]\([^)]+\)", r"\1", text)
-        # 7. 移除列表标记 - 或 *
-        text = re.sub(r"^\s*[-*]\s+(.*)", r"\1", text, flags=re.MULTILINE)
-        
+        for pattern, repl in _RE_MARKDOWN_PASSES:
+            text = pattern.sub(repl, text)
         return text
 
-    async def _render_image(self, md_text: str, output_path: str, min_width: int = 600):
-        """核心渲染逻辑"""
+    async def _render_image(self, md_text: str, min_width: int = 600) -> bytes:
+        """核心渲染逻辑，返回 PNG 图片数据"""
         if not self.browser or not self.browser.is_connected():
-            logger.warning("Browser 断开，正在重连...")
-            await self.initialize()
-            if not self.browser:
-                raise Exception("Browser 初始化失败")
+            # 加锁并二次检查，并发渲染只触发一次重连
+            async with self._browser_lock:
+                if not self.browser or not self.browser.is_connected():
+                    logger.warning("Browser 断开，正在重连...")
+                    await self._start_browser()
+
+        # 定期整体重建上下文，限制长期运行时渲染进程的内存增长
+        self._context_renders += 1
+        if self._context_renders >= self.CONTEXT_RECYCLE_EVERY:
+            async with self._browser_lock:
+                if self._context_renders >= self.CONTEXT_RECYCLE_EVERY:
+                    await self._recycle_context()
 
         # Markdown -> HTML
-        html_body = self.markdown_parser(md_text)
-        full_html = self._get_html_template(html_body, min_width)
+        html_body = _markdown_to_html(md_text)
+        full_html = self._get_html_template(html_body, min_width, _has_math(md_text))
 
-        # 创建页面 (使用大 Viewport 防止宽公式强制换行)
-        context = await self.browser.new_context(
-            device_scale_factor=2, 
-            viewport={'width': 1600, 'height': 1200} 
-        )
-        page = await context.new_page()
+        page = await self._acquire_page()
 
         try:
-            await page.set_content(full_html, wait_until="networkidle")
+            # 以 data: URL 直接导航载入页面，走普通导航流程，省去 set_content 的脚本注入；
+            # MathJax 脚本为同步加载，DOMContentLoaded 时已执行完毕，无需等待 networkidle
+            data_url = "data:text/html;charset=utf-8;base64," + base64.b64encode(full_html.encode("utf-8")).decode("ascii")
+            if len(data_url) < _DATA_URL_MAX_LEN:
+                await page.goto(data_url, wait_until="domcontentloaded")
+            else:
+                # 超长内容 (大表格、长代码块) 超出 Chromium 的 URL 长度上限，退回 set_content
+                await page.set_content(full_html, wait_until="domcontentloaded")
 
-            # 显式触发 MathJax 渲染
-            await page.evaluate("""
-                () => {
-                    if (window.MathJax) {
-                        return MathJax.typesetPromise();
+            # 等 MathJax 启动完成后显式触发渲染 (脚本加载失败时直接输出原文)，
+            # 再等字体就绪，布局稳定后在同一次调用里量取 body 区域
+            rect = await page.evaluate("""
+                async () => {
+                    if (window.MathJax && MathJax.startup && MathJax.startup.promise) {
+                        await MathJax.startup.promise;
+                        await MathJax.typesetPromise();
                     }
+                    if (document.fonts) {
+                        await document.fonts.ready;
+                    }
+                    const r = document.body.getBoundingClientRect();
+                    return {x: r.x, y: r.y, width: r.width, height: r.height};
                 }
             """)
-            
-            # 短暂等待布局稳定
-            await asyncio.sleep(0.3)
-
-            # 截图 body
-            body = await page.query_selector("body")
-            if body:
-                await body.screenshot(path=output_path)
-            else:
+            if not rect["width"] or not rect["height"]:
                 raise Exception("页面渲染为空")
 
+            # 直接通过 CDP 按区域截图，省去元素句柄查询
+            cdp = await self._get_cdp_session(page)
+            shot = await cdp.send("Page.captureScreenshot", {
+                "format": "png",
+                "captureBeyondViewport": True,
+                "clip": {**rect, "scale": 1},
+            })
+            return base64.b64decode(shot["data"])
+
         finally:
-            await page.close()
-            await context.close()
+            await self._release_page(page)
+
+    async def _acquire_page(self) -> Page:
+        """占用一个页面槽位：优先复用池中的空闲页面，没有则新建；槽位用尽时等待归还"""
+        await self._page_slots.acquire()
+        try:
+            while self._page_pool:
+                page = self._page_pool.pop()
+                if not page.is_closed():
+                    return page
+            return await self.context.new_page()
+        except Exception:
+            self._page_slots.release()
+            raise
+
+    async def _get_cdp_session(self, page: Page) -> CDPSession:
+        """获取页面对应的 CDP 会话，首次使用时创建"""
+        session = self._cdp_sessions.get(page)
+        if session is None:
+            session = await page.context.new_cdp_session(page)
+            self._cdp_sessions[page] = session
+        return session
+
+    async def _release_page(self, page: Page):
+        """归还页面槽位；页面重置后放回池中，失效或达到回收次数的页面直接关闭"""
+        try:
+            if page.is_closed():
+                return
+            if page.context is not self.context:
+                # 旧上下文 (已重建) 的页面不再复用；最后一个页面归还时关闭旧上下文
+                old_context = page.context
+                await page.close()
+                if all(p.is_closed() for p in old_context.pages):
+                    await old_context.close()
+                return
+            uses = self._page_uses.get(page, 0) + 1
+            if uses >= self.PAGE_RECYCLE_EVERY:
+                await page.close()
+                return
+            # 导航到空白页，清掉上一次渲染遗留的 DOM 和 MathJax 全局状态
+            await page.goto("about:blank")
+            self._page_uses[page] = uses
+            self._page_pool.append(page)
+        except Exception as e:
+            logger.warning(f"Markdown插件: 页面重置失败，已丢弃: {e}")
+            if not page.is_closed():
+                await page.close()
+        finally:
+            self._page_slots.release()
+
+    async def _block_external_resource(self, route: Route):
+        """拒绝渲染内容引用的外部图片/字体/媒体，避免远程资源拖慢页面加载"""
+        if route.request.resource_type in _BLOCKED_RESOURCE_TYPES:
+            await route.abort()
+        else:
+            await route.fallback()
+
+    async def _prefetch_mathjax(self):
+        """预取 MathJax 主脚本到本地镜像与内存，首次渲染无需等待 CDN 下载"""
+        if await self._load_mathjax_asset(_MATHJAX_ENTRY) is not None:
+            return
+        try:
+            response = await self.context.request.get(f"{_MATHJAX_CDN}{_MATHJAX_ENTRY}", timeout=15000)
+            if not response.ok:
+                raise Exception(f"HTTP {response.status}")
+            await self._store_mathjax_asset(_MATHJAX_ENTRY, await response.body())
+        except Exception as e:
+            # 预取失败不影响使用，首次渲染时会再经路由回源
+            logger.warning(f"Markdown插件: 预取 MathJax 失败: {e}")
 
-    def _get_html_template(self, content: str, min_width: int) -> str:
+    async def _load_mathjax_asset(self, rel_path: str):
+        """读取已缓存的 MathJax 资源：优先内存，其次本地镜像；都没有时返回 None"""
+        body = self._mathjax_assets.get(rel_path)
+        if body is None:
+            local_path = os.path.join(self.MATHJAX_DIR, rel_path)
+            if os.path.isfile(local_path):
+                body = await asyncio.to_thread(Path(local_path).read_bytes)
+                self._mathjax_assets[rel_path] = body
+        return body
+
+    async def _store_mathjax_asset(self, rel_path: str, body: bytes):
+        """把下载到的 MathJax 资源写入本地镜像与内存"""
+        local_path = os.path.join(self.MATHJAX_DIR, rel_path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        await asyncio.to_thread(_write_file_atomic, local_path, body)
+        self._mathjax_assets[rel_path] = body
+
+    async def _serve_mathjax_asset(self, route: Route):
+        """提供 MathJax 资源：优先内存，其次本地镜像；都缺失时回源下载一次并落盘"""
+        rel_path = route.request.url[len(_MATHJAX_CDN):].split("?", 1)[0]
+        local_path = os.path.normpath(os.path.join(self.MATHJAX_DIR, rel_path))
+        if not local_path.startswith(self.MATHJAX_DIR + os.sep):
+            await route.continue_()
+            return
+
+        # 渲染页为 data: URL (不透明源)，MathJax 资源均属跨域加载，本地响应补上 CORS 头
+        headers = {"Access-Control-Allow-Origin": "*"}
+        body = await self._load_mathjax_asset(rel_path)
+        if body is not None:
+            content_type = mimetypes.guess_type(local_path)[0] or "application/octet-stream"
+            await route.fulfill(body=body, content_type=content_type, headers=headers)
+            return
+
+        try:
+            response = await route.fetch()
+            body = await response.body()
+        except Exception as e:
+            logger.warning(f"Markdown插件: MathJax 资源下载失败 {rel_path}: {e}")
+            await route.abort()
+            return
+
+        if response.ok:
+            await self._store_mathjax_asset(rel_path, body)
+        await route.fulfill(response=response, body=body, headers={**response.headers, **headers})
+
+    def _get_html_template(self, content: str, min_width: int, with_math: bool = True) -> str:
         """生成 HTML 模板：含 MathJax 配置、GitHub 风格 CSS、自适应布局"""
-        return f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <script>
-            window.MathJax = {{
-                tex: {{
-                    inlineMath: [['$', '$'], ['\\\\(', '\\\\)']],
-                    displayMath: [['$$', '$$'], ['\\\\[', '\\\\]']],
-                }},
-                options: {{ enableMenu: false }},
-                svg: {{ fontCache: 'global' }},
-                startup: {{ typeset: false }} 
-            }};
-            </script>
-            <script id="MathJax-script" async src="https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-mml-chtml.js"></script>
-            <style>
-                /* 彻底隐藏 MathJax Loading 条 */
-                #MathJax_Message {{
-                    display: none !important;
-                    visibility: hidden !important;
-                    opacity: 0 !important;
-                }}
-
-                body {{
-                    /* 自适应宽度布局 */
-                    width: fit-content;
-                    min-width: {min_width}px;
-                    max-width: 1500px;
-                    
-                    padding: 20px;
-                    margin: 0;
-                    background-color: white;
-                    display: inline-block; /* 配合 fit-content */
-                    
-                    font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Helvetica, Arial, sans-serif;
-                    font-size: 16px;
-                    line-height: 1.6;
-                    color: #24292e;
-                }}
-
-                img {{ max-width: 100%; height: auto; }}
-                
-                pre {{
-                    background-color: #f6f8fa;
-                    border-radius: 6px;
-                    padding: 16px;
-                    overflow: auto;
-                    font-family: SFMono-Regular, Consolas, "Liberation Mono", Menlo, monospace;
-                    font-size: 85%;
-                    line-height: 1.45;
-                }}
-                
-                table {{ border-collapse: collapse; margin-bottom: 16px; min-width: 50%; }}
-                th, td {{ border: 1px solid #dfe2e5; padding: 6px 13px; }}
-                tr:nth-child(2n) {{ background-color: #f6f8fa; }}
-                th {{ font-weight: 600; background-color: #f6f8fa; }}
-                
-                blockquote {{
-                    margin: 0;
-                    padding: 0 1em;
-                    color: #6a737d;
-                    border-left: 0.25em solid #dfe2e5;
-                }}
-                
-                h1, h2, h3 {{ border-bottom: 1px solid #eaecef; padding-bottom: .3em; }}
-            </style>
-        </head>
-        <body>
-            {content}
-        </body>
-        </html>
-        """
+        return _html_head(min_width, with_math) + content + _HTML_TAIL